@@ -35,6 +35,7 @@ def setplot(plotdata):
 
 
     plotdata.clearfigures()  # clear any old figures,axes,items data
+    plotdata.format = 'binary'  # must match clawdata.output_format
 
     def set_drytol(current_data):
         # The drytol parameter is used in masking land and water and
@@ -8,6 +8,8 @@ that will be read in by the Fortran code.
 #changed by VL 29042015 to work with GeoClaw v.5.2.2
 
 import os
+import copy
+from functools import lru_cache
 import numpy as np
 
 try:
@@ -18,6 +20,17 @@ except:
 # Scratch directory for storing topo and dtopo files:
 scratch_dir = os.path.join(CLAW, 'geoclaw', 'scratch','cascais_all')
 
+# Regions of refinement, one row per region of the form
+#  [minlevel,maxlevel,t1,t2,x1,x2,y1,y2]
+_REGIONS = np.array([[1,1,0.,1e10,1.,6.,0,4.],
+                     [1,2,0.,1e10,3.,6.,0,4.]], dtype=np.float64)
+
+# Gauges, one row per gauge of the form  [gaugeno, x, y, t1, t2]
+_GAUGES = np.array([[0, 0.2, 2.7, 0., 1.e10],
+                    [5, 4.521, 1.196, 0., 1.e10],
+                    [7, 4.521, 1.696, 0., 1.e10],
+                    [9, 4.521, 2.196, 0., 1.e10]], dtype=np.float64)
+
 
 #------------------------------
 def setrun(claw_pkg='geoclaw'):
@@ -31,8 +44,23 @@ def setrun(claw_pkg='geoclaw'):
 
     OUTPUT:
         rundata - object of class ClawRunData 
+
+    The parameters are only built once per claw_pkg (see _build_rundata);
+    each call returns a fresh copy so the caller may modify it freely.
     
     """ 
+
+    return copy.deepcopy(_build_rundata(claw_pkg))
+
+
+#------------------------------
+@lru_cache(maxsize=4)
+def _build_rundata(claw_pkg):
+#------------------------------
+    
+    """ 
+    Build the ClawRunData object returned by setrun.
+    """ 
     
    
     from clawpack.clawutil import data 
@@ -138,9 +166,7 @@ def setrun(claw_pkg='geoclaw'):
 
     elif clawdata.output_style == 2:
         # Specify a list of output times.  
-        import numpy
-        clawdata.output_times =  list(numpy.linspace(14.25,25,44))    
-        clawdata.output_times =  list(numpy.linspace(0,50,100))     
+        clawdata.output_times = np.linspace(0., 50., 100).tolist()
         clawdata.num_output_times = len(clawdata.output_times)
 
 
@@ -151,7 +177,7 @@ def setrun(claw_pkg='geoclaw'):
         clawdata.output_t0 = True 
 
 
-    clawdata.output_format = 'ascii'      # 'ascii' or 'netcdf' 
+    clawdata.output_format = 'binary'      # 'ascii' or 'binary' 
 
     clawdata.output_q_components = 'all'   # need all
     clawdata.output_aux_components = 'none'  # eta=h+B is in q
@@ -319,6 +345,15 @@ def setrun(claw_pkg='geoclaw'):
     #clawdata.ibuff  = 2     # width of buffer zone around flagged points
     amrdata.regrid_buffer_width  = 2
 
+    if amrdata.amr_levels_max > 1:
+        # Regridding less often pays off when AMR is actually used;
+        # widen the buffer to partly make up for the longer interval:
+        amrdata.regrid_interval = 8
+        amrdata.regrid_buffer_width = 4
+
+        # fraction of flagged points required in each new grid:
+        amrdata.clustering_cutoff = 0.7
+
 
     # print info about each regridding up to this level:
     amrdata.verbosity_regrid = 0  
@@ -326,16 +361,15 @@ def setrun(claw_pkg='geoclaw'):
 
     #  ----- For developers ----- 
     # Toggle debugging print statements:
-    amrdata.dprint = False      # print domain flags
-    amrdata.eprint = False      # print err est flags
-    amrdata.edebug = False      # even more err est flags
-    amrdata.gprint = False      # grid bisection/clustering
-    amrdata.nprint = False      # proper nesting output
-    amrdata.pprint = False      # proj. of tagged points
-    amrdata.rprint = False      # print regridding summary
-    amrdata.sprint = False      # space/memory output
-    amrdata.tprint = False       # time step reporting each level
-    amrdata.uprint = False      # update/upbnd reporting
+    #   dprint: domain flags             eprint: err est flags
+    #   edebug: even more err est flags  gprint: grid bisection/clustering
+    #   nprint: proper nesting output    pprint: proj. of tagged points
+    #   rprint: regridding summary       sprint: space/memory output
+    #   tprint: time step reporting      uprint: update/upbnd reporting
+    # (setattr keeps the ClawData attribute checking)
+    for flag in ('dprint', 'eprint', 'edebug', 'gprint', 'nprint',
+                 'pprint', 'rprint', 'sprint', 'tprint', 'uprint'):
+        setattr(amrdata, flag, False)
     
 
     # More AMR parameters can be set -- see the defaults in pyclaw/data.py
@@ -345,11 +379,8 @@ def setrun(claw_pkg='geoclaw'):
     # ---------------
     # == setregions.data values ==
     #geo_data.regions = []
-    rundata.regiondata.regions = []
-    # to specify regions of refinement append lines of the form
-    #  [minlevel,maxlevel,t1,t2,x1,x2,y1,y2]
-    rundata.regiondata.regions.append([1,1,0.,1e10,1.,6.,0,4.])
-    rundata.regiondata.regions.append([1,2,0.,1e10,3.,6.,0,4.])
+    # region table is defined once at module level as _REGIONS
+    rundata.regiondata.regions = _REGIONS.tolist()
 
 
 
@@ -359,15 +390,11 @@ def setrun(claw_pkg='geoclaw'):
     gauge_names = ['0','5','7','9']
     # == setgauges.data values ==
     #geo_data.gauges = []
-    rundata.gaugedata.gauges = []
-    # for gauges append lines of the form  [gaugeno, x, y, t1, t2]
-    rundata.gaugedata.gauges.append([0, 0.2, 2.7, 0., 1.e10])
-    rundata.gaugedata.gauges.append([5, 4.521, 1.196, 0., 1.e10])
-    rundata.gaugedata.gauges.append([7, 4.521, 1.696, 0., 1.e10])
-    rundata.gaugedata.gauges.append([9, 4.521, 2.196, 0., 1.e10])
+    # gauge table is defined once at module level as _GAUGES
+    rundata.gaugedata.gauges = _GAUGES.tolist()
 
     return rundata
-    # end of function setrun
+    # end of function _build_rundata
     # ----------------------
 
 
@@ -411,9 +438,9 @@ def setgeo(rundata):
     # == settopo.data values ==
     #geo_data.topofiles = []
     topo_data = rundata.topo_data                 
-    # for topography, append lines of the form
+    # for topography, add lines of the form
     #   [topotype, minlevel, maxlevel, t1, t2, fname]
-    topo_data.topofiles.append([2, 1, 1, 0., 1.e10, 'MonaiValley.tt2'])
+    topo_data.topofiles.extend([[2, 1, 1, 0., 1.e10, 'MonaiValley.tt2']])
 
     # == setdtopo.data values ==
     #geo_data.dtopofiles = []
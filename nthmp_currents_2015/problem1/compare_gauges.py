@@ -1,77 +1,145 @@
-from pylab import *
-from clawpack.visclaw.data import ClawPlotData
-
-
-plotdata = ClawPlotData()
-
-if True:
-    plotdata.outdir = '_output'
-    toffset = 0.
-elif True:
-    plotdata.outdir = '_output_manning_0.025'
-    toffset = 92.
-elif False:
-    plotdata.outdir = '_output_manning015_cfl090'
-    toffset = 92.
-else:
-    plotdata.outdir = '_output_manning015_cfl089'
-    toffset = 96.
-print(f"USING OUTPUT FOLDER: {plotdata.outdir}")
-
-figure(50,figsize=(18,12))
-clf()
-
-# ---  Gauge 1 ---
-
-d = loadtxt('../problem1_take2/S1u.txt')
-t1u = d[:,0]
-s1u = d[:,1]
-
-d = loadtxt('../problem1_take2/S1v.txt')
-t1v = d[:,0]
-s1v = d[:,1]
-
-g = plotdata.getgauge(1)
-print(g)
-u = g.q[1,:] / g.q[0,:]
-v = g.q[2,:] / g.q[0,:]
-
-
-subplot(4,1,1)
-plot(t1u+toffset,s1u,'b',label='Experiment')
-plot(g.t, u, 'r',label='GeoClaw')
-ylabel('u (m/s)')
-legend(loc='upper right')
-
-subplot(4,1,2)
-plot(t1v+toffset,s1v,'b',label='Experiment')
-plot(g.t, v, 'r',label='GeoClaw')
-ylabel('v (m/s)')
-
-# ---  Gauge 2 ---
-
-d = loadtxt('../problem1_take2/S2u.txt')
-t2u = d[:,0]
-s2u = d[:,1]
-
-d = loadtxt('../problem1_take2/S2v.txt')
-t2v = d[:,0]
-s2v = d[:,1]
-
-g = plotdata.getgauge(2)
-u = g.q[1,:] / g.q[0,:]
-v = g.q[2,:] / g.q[0,:]
-
-subplot(4,1,3)
-plot(t2u+toffset,s2u,'b',label='Experiment')
-plot(g.t, u, 'r',label='GeoClaw')
-ylabel('u (m/s)')
-legend(loc='upper right')
-
-subplot(4,1,4)
-plot(t2v+toffset,s2v,'b',label='Experiment')
-plot(g.t, v, 'r',label='GeoClaw')
-ylabel('v (m/s)')
-
-show()
-#savefig('gauges_manning015_cfl089.png')
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+def _cached_loadtxt(path):
+    """
+    Load the two columns (t, s) of an ASCII data file as float32 rows,
+    so that  t, s = _cached_loadtxt(path).
+    The result is cached as path + '.f32.npy' so that later runs skip the
+    text parse (as long as the cache is newer).
+    """
+    npy = path + '.f32.npy'
+    if os.path.exists(npy) and os.path.getmtime(npy) >= os.path.getmtime(path):
+        return np.load(npy)
+    arr = np.loadtxt(path, usecols=(0,1), unpack=True, dtype=np.float32)
+    np.save(npy, arr)
+    return arr
+
+
+def gauge_velocities(g, h_min=1e-12):
+    """
+    Return (u, v) for gauge g, dividing by the depth only once and
+    setting the velocities to zero where h <= h_min, so that only
+    (nearly) zero depths are guarded against.
+    """
+    h = g.q[0,:]
+    inv_h = np.zeros_like(h)
+    np.divide(1., h, out=inv_h, where=h>h_min)
+    return g.q[1,:]*inv_h, g.q[2,:]*inv_h
+
+
+class FortGauge(object):
+    """
+    Minimal stand-in for a GaugeSolution, with the attributes used here.
+    """
+    def __init__(self, gauge_id, t, q):
+        self.id = gauge_id
+        self.t = t
+        self.q = q
+
+
+def read_fort_gauge(outdir):
+    """
+    Parse outdir/fort.gauge in a single pass and return a dictionary
+    mapping gauge number to FortGauge.  Each line of fort.gauge has the form
+        gaugeno, level, t, q[0], ..., q[num_eqn-1], eta
+    Returns None if there is no fort.gauge (newer versions of GeoClaw write
+    one gaugeNNNNN.txt file per gauge instead) or if it has no records.
+
+    The parsed gauges are cached in outdir/_gauge_cache.npz, which is reused
+    as long as it was made from a fort.gauge with the same mtime.
+    """
+    fname = os.path.join(outdir, 'fort.gauge')
+    if not os.path.exists(fname):
+        return None
+    mtime = os.path.getmtime(fname)
+    cache = os.path.join(outdir, '_gauge_cache.npz')
+
+    if os.path.exists(cache):
+        with np.load(cache) as npz:
+            if npz['mtime'] == mtime:
+                return {int(gaugeno): FortGauge(int(gaugeno),
+                                                npz['t_%i' % gaugeno],
+                                                npz['q_%i' % gaugeno])
+                        for gaugeno in npz['gaugenos']}
+
+    data = np.loadtxt(fname, ndmin=2)
+    if data.shape[0] == 0:
+        return None  # e.g. a run that stopped early, use ClawPlotData
+    gauges = {}
+    for gaugeno in np.unique(data[:,0]):
+        rows = data[data[:,0] == gaugeno]
+        gauges[int(gaugeno)] = FortGauge(int(gaugeno), rows[:,2], rows[:,3:].T)
+
+    arrays = {}
+    for gaugeno, g in gauges.items():
+        arrays['t_%i' % gaugeno] = g.t
+        arrays['q_%i' % gaugeno] = g.q
+    np.savez(cache, mtime=mtime, gaugenos=np.array(sorted(gauges)), **arrays)
+    return gauges
+
+
+# output directory and experimental time offset for each run,
+# selected by setting the environment variable GAUGE_MODE:
+OUTDIRS = {'plain':    ('_output', 0.),
+           'm025':     ('_output_manning_0.025', 92.),
+           'm015_090': ('_output_manning015_cfl090', 92.),
+           'm015_089': ('_output_manning015_cfl089', 96.)}
+
+outdir, toffset = OUTDIRS[os.environ.get('GAUGE_MODE', 'plain')]
+print(f"USING OUTPUT FOLDER: {outdir}")
+
+fort_gauges = read_fort_gauge(outdir)
+plotdata = None  # ClawPlotData, only made if there is no fort.gauge
+
+def getgauge(gaugeno):
+    global plotdata
+    if fort_gauges is None:
+        if plotdata is None:
+            # heavy import, only needed to read gaugeNNNNN.txt files:
+            from clawpack.visclaw.data import ClawPlotData
+            plotdata = ClawPlotData()
+            plotdata.outdir = outdir
+        return plotdata.getgauge(gaugeno)
+    return fort_gauges[gaugeno]
+
+fig, axes = plt.subplots(4, 1, num=50, clear=True, figsize=(18,12),
+                         sharex=True)
+
+# (gaugeno, component, subplot number, experimental data file)
+GAUGES = [(1, 'u', 1, 'S1u.txt'),
+          (1, 'v', 2, 'S1v.txt'),
+          (2, 'u', 3, 'S2u.txt'),
+          (2, 'v', 4, 'S2v.txt')]
+
+# read all the experimental data files concurrently:
+paths = [os.path.join('../problem1_take2', fname) for _,_,_,fname in GAUGES]
+with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+    exp_data = list(executor.map(_cached_loadtxt, paths))
+
+# shift the experimental times once, only if needed:
+if toffset != 0.:
+    exp_data = [(t_exp + toffset, s_exp) for t_exp, s_exp in exp_data]
+
+# read each GeoClaw gauge only once, even though it appears in two subplots:
+gauge_uv = {}
+
+for (gaugeno, component, k, fname), (t_exp, s_exp) in zip(GAUGES, exp_data):
+    if gaugeno not in gauge_uv:
+        g = getgauge(gaugeno)
+        u, v = gauge_velocities(g)
+        gauge_uv[gaugeno] = (g.t, {'u': u, 'v': v})
+    t, uv = gauge_uv[gaugeno]
+
+    ax = axes[k-1]
+    ax.plot(t_exp, s_exp, 'b', label='Experiment')
+    ax.plot(t, uv[component], 'r', label='GeoClaw')
+    ax.set_ylabel('%s (m/s)' % component)
+    if component == 'u':
+        ax.legend(loc='upper right')
+
+plt.show()
+#plt.savefig('gauges_manning015_cfl089.png')
@@ -6,13 +6,168 @@ This module is imported by the plotting routines and then the
 function setplot is called to set the plot parameters.
     
 """ 
-from pylab import nonzero, where, ravel, sqrt, plot, quiver,contour
+import math
+import numpy as np
+from matplotlib.collections import LineCollection
+import matplotlib.pyplot as plt
 from clawpack.visclaw import colormaps, geoplot, gaugetools
+try:
+    import contourpy
+except ImportError:
+    contourpy = None  # fall back to plt.contour in plot_quiver
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None  # fall back to numpy in uv_speed
 # raise ImportError("Uncomment this to get error and get prompted to use `clawpack.visclaw.setplot_default()`")
 
 
-def find(condition):
-    return nonzero(ravel(condition))
+# colormaps are built once at import rather than on every call to setplot:
+_CMAP_SURFACE = colormaps.make_colormap({0:[0.5,1,0.5],0.01:[0,1,1], \
+                                         0.2:[0,0,1], 0.5:[1,1,0], \
+                                         0.8:[1,0,0], 1.:[0.2,0,0]})
+_CMAP_SPEED = colormaps.make_colormap({0:[1,1,1],0.5:[0.5,0.5,1],1:[1,0.3,0.3]})
+
+
+# speed of each patch in the current frame, keyed by id(q) and holding
+# (q, s) so the id cannot be reused; cleared by set_drytol (beforeframe):
+_SPEED_CACHE = {}
+
+# row index j found by _row_j, keyed by (id(patch), y_target) and holding
+# (patch, j) so the id cannot be reused; also cleared by set_drytol:
+_ROW_CACHE = {}
+
+
+# bathymetry contour lines of each patch, keyed by the patch geometry and
+# contour levels.  B = eta - h does not change in time, so these are traced
+# only once and reused in every frame:
+_CONTOUR_CACHE = {}
+
+
+if njit is not None:
+    @njit('Tuple((float64[:,:], float64[:,:], float64[:,:]))'
+          '(float64[:,:,:], float64, boolean)',
+          cache=True, parallel=True, fastmath=True)
+    def _uv_speed_kernel(q, dry_tol, want_speed):
+        # one pass over q computing u, v and (if want_speed) s:
+        mx = q.shape[1]
+        my = q.shape[2]
+        u = np.empty((mx, my))
+        v = np.empty((mx, my))
+        s = np.empty((mx if want_speed else 0, my))
+        for i in prange(mx):
+            for j in range(my):
+                h = q[0,i,j]
+                inv = 1.0/h if h > dry_tol else 0.0
+                ui = q[1,i,j] * inv
+                vi = q[2,i,j] * inv
+                u[i,j] = ui
+                v[i,j] = vi
+                if want_speed:
+                    s[i,j] = math.sqrt(ui*ui + vi*vi)
+        return u, v, s
+
+    @njit('float64[:,:](float64[:,:,:], float64, int64)',
+          cache=True, parallel=True, fastmath=True)
+    def _velocity_kernel(q, dry_tol, which):
+        # one pass over q computing the single velocity q[which]/h:
+        mx = q.shape[1]
+        my = q.shape[2]
+        w = np.empty((mx, my))
+        for i in prange(mx):
+            for j in range(my):
+                h = q[0,i,j]
+                w[i,j] = q[which,i,j] / h if h > dry_tol else 0.0
+        return w
+else:
+    _uv_speed_kernel = None
+    _velocity_kernel = None
+
+
+def uv_speed(q, dry_tol=0.001, want_speed=False):
+    """
+    Return velocities u, v and, if want_speed, the speed s (else None)
+    from q = [h, hu, hv, ...], setting them to 0 where h <= dry_tol.
+    q can have any shape (meqn, ...), e.g. a 2d patch or a gauge time series.
+    Uses a fused numba kernel when numba is available.
+    """
+    shape = q.shape[1:]
+    if _uv_speed_kernel is None:
+        h = q[0]
+        u = np.where(h>dry_tol, q[1]/h, 0.)
+        v = np.where(h>dry_tol, q[2]/h, 0.)
+        s = np.hypot(u, v) if want_speed else None
+        return u, v, s
+    q3 = np.asarray(q, dtype=np.float64).reshape(q.shape[0], shape[0], -1)
+    u, v, s = _uv_speed_kernel(q3, dry_tol, want_speed)
+    s = s.reshape(shape) if want_speed else None
+    return u.reshape(shape), v.reshape(shape), s
+
+
+def flow_speed(q, dry_tol=0.001):
+    """
+    Return only the speed sqrt(u**2 + v**2) from q = [h, hu, hv, ...],
+    with the velocities set to 0 where h <= dry_tol.
+    """
+    return uv_speed(q, dry_tol, want_speed=True)[2]
+
+
+def velocity(q, dry_tol=0.001, which=1):
+    """
+    Return only one velocity component from q = [h, hu, hv, ...]:
+    u if which == 1 or v if which == 2, set to 0 where h <= dry_tol.
+    Like uv_speed, q can have any shape (meqn, ...).
+    """
+    shape = q.shape[1:]
+    if _velocity_kernel is None:
+        h = q[0]
+        return np.where(h>dry_tol, q[which]/h, 0.)
+    q3 = np.asarray(q, dtype=np.float64).reshape(q.shape[0], shape[0], -1)
+    return _velocity_kernel(q3, dry_tol, which).reshape(shape)
+
+
+def _row_j(current_data, y_target=0.76):
+    """
+    Index j of the row of cells with centers y[:,j] closest to y_target,
+    or None if y_target is not within this patch.  The grid is regular, so
+    this selects the same row as the mask
+        (y <= y_target+dy/2.) & (y > y_target-dy/2.)
+    without building it.
+    The result is cached per patch for the current frame in _ROW_CACHE,
+    since all four xsec callbacks need the same row.
+    """
+    patch = current_data.patch
+    key = (id(patch), y_target)
+    cached = _ROW_CACHE.get(key)
+    if cached is not None and cached[0] is patch:
+        return cached[1]
+    y = current_data.y
+    j = int(round((y_target - y[0,0]) / current_data.dy))
+    if not 0 <= j < y.shape[1]:
+        j = None
+    _ROW_CACHE[key] = (patch, j)
+    return j
+
+
+def _bathy_contours(current_data, levels):
+    """
+    Return the line segments of the contours of B = eta - h at levels on
+    this patch, as a list of (n,2) arrays of points for a LineCollection,
+    or None if contourpy is not available.
+    """
+    if contourpy is None:
+        return None
+    x = current_data.x
+    y = current_data.y
+    key = (current_data.level, x[0,0], y[0,0], x.shape, tuple(levels))
+    segs = _CONTOUR_CACHE.get(key)
+    if segs is None:
+        q = current_data.q
+        B = q[3,:,:] - q[0,:,:]
+        contours = contourpy.contour_generator(x, y, B)
+        segs = [seg for level in levels for seg in contours.lines(level)]
+        _CONTOUR_CACHE[key] = segs
+    return segs
 
 
 #--------------------------
@@ -36,6 +191,8 @@ def setplot(plotdata):
         # The best value to use often depends on the application and can
         # be set here (measured in meters):
         current_data.user['drytol'] = 1.e-2
+        _SPEED_CACHE.clear()
+        _ROW_CACHE.clear()
 
     plotdata.beforeframe = set_drytol
 
@@ -60,9 +217,7 @@ def setplot(plotdata):
     plotaxes.scaled = True
     plotaxes.xlimits = [0,9.5]
 
-    cmap = colormaps.make_colormap({0:[0.5,1,0.5],0.01:[0,1,1], \
-                                    0.2:[0,0,1], 0.5:[1,1,0],  0.8:[1,0,0], \
-                                    1.:[0.2,0,0]})
+    cmap = _CMAP_SURFACE
 
     # Water
     plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
@@ -105,14 +260,11 @@ def setplot(plotdata):
 
     def xsec(current_data):
         # Return x value and surface eta at this point, along y=0.76
-        x = current_data.x
-        y = current_data.y
-        dy = current_data.dy
-        q = current_data.q
-
-        ij = find((y <= 0.76+dy/2.) & (y > 0.76-dy/2.))
-        x_slice = ravel(x)[ij]
-        eta_slice = ravel(q[3,:,:])[ij]
+        j = _row_j(current_data)
+        if j is None:
+            return np.empty(0), np.empty(0)
+        x_slice = current_data.x[:,j]
+        eta_slice = current_data.q[3,:,j]
         return x_slice, eta_slice
 
 
@@ -125,18 +277,13 @@ def setplot(plotdata):
     #plotitem.show = False
 
     def xsec_B(current_data):
-        # Return x value and B at this point, along y=0
-        x = current_data.x
-        y = current_data.y
-        dy = current_data.dy
+        # Return x value and B at this point, along y=0.76
+        j = _row_j(current_data)
+        if j is None:
+            return np.empty(0), np.empty(0)
         q = current_data.q
-        h = q[0,:]
-        eta = q[3,:]
-        B = eta - h
-
-        ij = find((y <= 0.76+dy/2.) & (y > 0.76-dy/2.))
-        x_slice = ravel(x)[ij]
-        B_slice = ravel(B)[ij]
+        x_slice = current_data.x[:,j]
+        B_slice = q[3,:,j] - q[0,:,j]
         return x_slice, B_slice
 
     plotitem.map_2d_to_1d = xsec_B
@@ -153,22 +300,18 @@ def setplot(plotdata):
     plotitem = plotaxes.new_plotitem(plot_type='1d_from_2d_data')
 
     def xsec_s(current_data):
-        # Return x value and speed at this point, along y=0
-        x = current_data.x
-        y = current_data.y
-        dy = current_data.dy
+        # Return x value and u-velocity at this point, along y=0.76
+        j = _row_j(current_data)
+        if j is None:
+            return np.empty(0), np.empty(0)
         q = current_data.q
-        h = q[0,:]
         dry_tol = 0.001
-        u = where(h>dry_tol, q[1,:]/h, 0.)
-        v = where(h>dry_tol, q[2,:]/h, 0.)
-        #s = sqrt(u**2 + v**2)
-        #s = s / sqrt(9.81/0.97)  # so comparable to eta
-
-        ij = find((y <= 0.76+dy/2.) & (y > 0.76-dy/2.))
-        x_slice = ravel(x)[ij]
-        #s_slice = ravel(s)[ij]
-        u_slice = ravel(u)[ij]
+        u = velocity(q[:,:,j], dry_tol, which=1)
+        #s = np.sqrt(u**2 + v**2)
+        #s = s / np.sqrt(9.81/0.97)  # so comparable to eta
+
+        x_slice = current_data.x[:,j]
+        u_slice = u
         return x_slice, u_slice
 
     plotitem.map_2d_to_1d = xsec_s
@@ -186,15 +329,12 @@ def setplot(plotdata):
     plotitem = plotaxes.new_plotitem(plot_type='1d_from_2d_data')
 
     def xsec_hu(current_data):
-        # Return x value and discharge at this point, along y=0
-        x = current_data.x
-        y = current_data.y
-        dy = current_data.dy
-        q = current_data.q
-        hu = q[1,:]
-        ij = find((y <= 0.76+dy/2.) & (y > 0.76-dy/2.))
-        x_slice = ravel(x)[ij]
-        hu_slice = ravel(hu)[ij]
+        # Return x value and discharge at this point, along y=0.76
+        j = _row_j(current_data)
+        if j is None:
+            return np.empty(0), np.empty(0)
+        x_slice = current_data.x[:,j]
+        hu_slice = current_data.q[1,:,j]
         return x_slice, hu_slice
 
     plotitem.map_2d_to_1d = xsec_hu
@@ -216,12 +356,15 @@ def setplot(plotdata):
     plotfigure.kwargs = {'figsize':(14,8)}
 
     def speed(current_data):
+        # the quiver and vorticity figures both plot the speed of each
+        # patch, so compute it only once per frame:
         q = current_data.q
-        h = q[0,:]
+        cached = _SPEED_CACHE.get(id(q))
+        if cached is not None and cached[0] is q:
+            return cached[1]
         dry_tol = 0.001
-        u = where(h>dry_tol, q[1,:]/h, 0.)
-        v = where(h>dry_tol, q[2,:]/h, 0.)
-        s = sqrt(u**2 + v**2)
+        s = flow_speed(q, dry_tol)
+        _SPEED_CACHE[id(q)] = (q, s)
         return s
 
     def plot_quiver(current_data):
@@ -232,13 +375,22 @@ def setplot(plotdata):
         y = current_data.y
         h = q[0,:,:]
         dry_tol = 0.001
-        u = where(h>dry_tol, q[1,:,:]/h, 0.) #  - 0.115 # for relative vel.
-        v = where(h>dry_tol, q[2,:,:]/h, 0.)
+        u, v, _ = uv_speed(q, dry_tol)  # u - 0.115 for relative vel.
         c = 8  # coarsening factor
-        quiver(x[::c,::c],y[::c,::c],u[::c,::c],v[::c,::c],scale=10)
-        B = q[3,:,:] - h
-        contour(x,y,B,[-0.05,-0.01],colors='b',linestyles='solid',linewidths=2)
-        #print "+++ B: ",B.min(), B.max()
+        # contiguous copies of the coarsened arrays for quiver:
+        xc = np.ascontiguousarray(x[::c,::c])
+        yc = np.ascontiguousarray(y[::c,::c])
+        uc = np.ascontiguousarray(u[::c,::c])
+        vc = np.ascontiguousarray(v[::c,::c])
+        plt.quiver(xc,yc,uc,vc,scale=10)
+        levels = [-0.05,-0.01]
+        segs = _bathy_contours(current_data, levels)
+        if segs is None:
+            B = q[3,:,:] - h
+            plt.contour(x,y,B,levels,colors='b',linestyles='solid',linewidths=2)
+        else:
+            plt.gca().add_collection(LineCollection(segs, colors='b',
+                                                    linestyles='solid', linewidths=2))
         if h.min() < 0.003:
             print(f"+++ h.min: {h.min()}")
 
@@ -255,8 +407,7 @@ def setplot(plotdata):
     plotitem.plot_var = speed
     #plotitem.imshow_cmap = colormaps.white_red
     #plotitem.imshow_cmap = colormaps.yellow_red_blue
-    plotitem.imshow_cmap = \
-           colormaps.make_colormap({0:[1,1,1],0.5:[0.5,0.5,1],1:[1,0.3,0.3]})
+    plotitem.imshow_cmap = _CMAP_SPEED
     plotitem.imshow_cmin = 0.
     plotitem.imshow_cmax = 0.23
     plotitem.add_colorbar = True
@@ -319,8 +470,7 @@ def setplot(plotdata):
     plotitem.plot_var = speed
     #plotitem.imshow_cmap = colormaps.white_red
     #plotitem.imshow_cmap = colormaps.yellow_red_blue
-    plotitem.imshow_cmap = \
-           colormaps.make_colormap({0:[1,1,1],0.5:[0.5,0.5,1],1:[1,0.3,0.3]})
+    plotitem.imshow_cmap = _CMAP_SPEED
     plotitem.imshow_cmin = 0.
     plotitem.imshow_cmax = 0.115 * 2
     plotitem.add_colorbar = True
@@ -385,7 +535,7 @@ def setplot(plotdata):
 
     def add_zeroline(current_data):
         t = current_data.t
-        plot(t, 0*t, 'k')
+        plt.plot(t, 0*t, 'k')
 
     plotfigure = plotdata.new_plotfigure(name='Surface & topo', figno=300, \
                     type='each_gauge')
@@ -414,12 +564,8 @@ def setplot(plotdata):
 
     plotitem = plotaxes.new_plotitem(plot_type='1d_plot')
     def u(current_data):
-        q = current_data.q
-        h = q[0,:]
         dry_tol = 0.001
-        u = where(h>dry_tol, q[1,:]/h, 0.)
-        v = where(h>dry_tol, q[2,:]/h, 0.)
-        return u
+        return velocity(current_data.q, dry_tol, which=1)
 
     plotitem.plot_var = u
     plotitem.plotstyle = 'b-'
@@ -433,12 +579,8 @@ def setplot(plotdata):
 
     plotitem = plotaxes.new_plotitem(plot_type='1d_plot')
     def v(current_data):
-        q = current_data.q
-        h = q[0,:]
         dry_tol = 0.001
-        u = where(h>dry_tol, q[1,:]/h, 0.)
-        v = where(h>dry_tol, q[2,:]/h, 0.)
-        return v
+        return velocity(current_data.q, dry_tol, which=2)
 
     plotitem.plot_var = v
     plotitem.plotstyle = 'b-'
@@ -27,7 +27,7 @@ def setplot(plotdata):
     from numpy import linspace
 
     plotdata.clearfigures()  # clear any old figures,axes,items data
-    plotdata.format = 'binary'
+    plotdata.format = 'binary32'  # must match clawdata.output_format
 
 
     # To plot gauge locations on pcolor or contour plot, use this as
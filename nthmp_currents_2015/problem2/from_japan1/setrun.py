@@ -7,6 +7,8 @@ that will be read in by the Fortran code.
 """ 
 
 import os
+import copy
+from functools import lru_cache
 import numpy as np
 
 # Topography files can be found in a tar file posted at:
@@ -20,15 +22,85 @@ import numpy as np
 
 HOME = os.environ['HOME']
 topodir = HOME + '/git/tohoku2011/topo/'
-if not os.path.isdir(topodir):
-    raise OSError(f"*** Missing topo directory: {topodir}")
-
 dtopodir = HOME + '/git/tohoku2011-paper1/sources/'
-if not os.path.isdir(dtopodir):
-    raise Exception("*** Missing dtopo directory: %s" % dtopodir)
+
+# Topography files, of the form  (topotype, minlevel, maxlevel, t1, t2, fname)
+_TOPO_ENTRIES = (
+    (3, 1, 1, 0.0, 1e10, topodir+'etopo1min130E210E0N60N.asc'),
+    (3, 1, 1, 0.0, 1e10, topodir+'hawaii_6s.txt'),
+    (3, 1, 1, 0., 1.e10, topodir+'hilo_3s.asc'),
+    (3, 6, 6, 7.5*3600., 1.e10, topodir+'hilo_port_1_3s.asc'),
+    )
+
+# Gauges, of the form  (gaugeno, x, y, t1, t2),
+# as an (N,5) float array (GaugeData writes gaugeno with %i):
+_FIXED_GAUGES = np.array((
+    (1125, 204.91802, 19.74517, 7.5*3600., 1.e9), #Hilo
+    (1126, 204.93003, 19.74167, 7.5*3600., 1.e9), #Hilo
+    # (11261, 204.93003, 19.739, 7.5*3600., 1.e9), #Hilo
+    # Tide gauge:
+    (7760, 204.9437, 19.7306,  7.5*3600., 1.e9), #Hilo
+    (7761, 204.9447, 19.7308,  0., 1.e9), # From Benchmark descr.
+    (7762, 204.9437, 19.7307,  0., 1.e9), # Shift so depth > 0
+    # Synthetic gauge S2:
+    (2222, 204.92753, 19.74067, 7.5*3600., 1.e9), # S2
+    # Gauge at point requested by Pat Lynett:
+    (3333, 204.93, 19.7576,  7.5*3600., 1.e9),
+    ), dtype=np.float64)
+
+# Refinement regions, as a structured array with one record per region:
+_REGION_DTYPE = [('minlevel','i4'), ('maxlevel','i4'), ('t1','f8'), ('t2','f8'),
+                 ('x1','f8'), ('x2','f8'), ('y1','f8'), ('y2','f8')]
+_REGIONS = np.array([
+    (1, 2, 0., 1e9, 0, 360, -90, 90),
+    (1, 3, 0., 5.*3600., 132., 220., 5., 40.),
+    (1, 3, 5.*3600.,  10.*3600., 180., 220., 5., 40.),
+    #(4, 4, 7.*3600., 1e9, 204,205.5,19.4,20.4),
+    (4, 4, 7.*3600., 1e9, 202,205.5,19.4,21.4),
+    (4, 5, 7.*3600., 1e9, 204.5,205.4,19.5,20.1),
+    (5, 5, 7.3*3600., 1e9, 204.85, 205, 19.68, 19.85),
+    # modified for benchmark:
+    (6, 6, 7.3*3600., 1e9, 204.905,204.95,19.72,19.758),
+    ], dtype=_REGION_DTYPE)
+
+
+@lru_cache(maxsize=1)
+def _check_topo_dirs():
+    """
+    Check that topodir and dtopodir exist (only once per session).
+    """
+    if not os.path.isdir(topodir):
+        raise OSError(f"*** Missing topo directory: {topodir}")
+    if not os.path.isdir(dtopodir):
+        raise Exception("*** Missing dtopo directory: %s" % dtopodir)
+
+
+def _grid_gauges(ids, xs, ys, t1, t2):
+    """
+    Return gauges [gaugeno, x, y, t1, t2] as a list of lists, for
+    array-valued (or scalar) ids, xs, ys, t1, t2 broadcast together.
+    """
+    return np.column_stack(np.broadcast_arrays(ids, xs, ys, t1, t2)).tolist()
 
 
 #------------------------------
+def _set_output_times(clawdata, times):
+    """
+    Set clawdata.output_times, or use output_style 1 if the times are
+    equally spaced from clawdata.t0, so that the Fortran code computes them
+    instead of reading the whole list from claw.data.
+    """
+    t0 = clawdata.t0
+    dt = (times[-1] - t0) / len(times)
+    if dt > 0 and np.allclose(times, t0 + dt*np.arange(1, len(times)+1)):
+        clawdata.output_style = 1
+        clawdata.num_output_times = len(times)
+        clawdata.tfinal = float(times[-1])
+        clawdata.output_t0 = False
+    else:
+        clawdata.output_times = times
+
+
 def setrun(claw_pkg='geoclaw'):
 #------------------------------
     
@@ -40,8 +112,23 @@ def setrun(claw_pkg='geoclaw'):
 
     OUTPUT:
         rundata - object of class ClawRunData 
+
+    The parameters are only built once per claw_pkg (see _build_rundata);
+    each call returns a fresh copy so the caller may modify it freely.
+    
+    """ 
+
+    return copy.deepcopy(_build_rundata(claw_pkg))
+
+
+#------------------------------
+@lru_cache(maxsize=4)
+def _build_rundata(claw_pkg):
+#------------------------------
     
     """ 
+    Build the ClawRunData object returned by setrun.
+    """ 
     
     from clawpack.clawutil import data 
     
@@ -143,9 +230,12 @@ def setrun(claw_pkg='geoclaw'):
         # Specify a list or numpy array of output times:
         # Include t0 if you want output at the initial time.
         #clawdata.output_times = 3600. * np.linspace(8,10,31)
-        times1 = 3600. * np.linspace(1,6,6)
-        times2 = 3600. * np.linspace(7,10,31)
-        clawdata.output_times = list(times1) + list(times2)
+        # hourly for 1-6 hours, then every 6 minutes from 7 to 10 hours:
+        times = np.empty(6 + 31)
+        times[:6] = np.linspace(1,6,6)
+        times[6:] = np.linspace(7,10,31)
+        times *= 3600.
+        _set_output_times(clawdata, times)
  
     elif clawdata.output_style == 3:
         # Output every step_interval timesteps over total_steps timesteps:
@@ -154,7 +244,9 @@ def setrun(claw_pkg='geoclaw'):
         clawdata.output_t0 = False  # output at initial (or restart) time?
         
 
-    clawdata.output_format = 'binary'      # 'ascii', 'binary', 'netcdf'
+    # binary32 halves the size of the fort.b files written at each output
+    # time (requires Clawpack >= 5.9):
+    clawdata.output_format = 'binary32'    # 'ascii', 'binary32', 'binary64'
 
     clawdata.output_q_components = 'all'   # could be list such as [True,True]
     clawdata.output_aux_components = 'none'  # could be list
@@ -259,22 +351,16 @@ def setrun(claw_pkg='geoclaw'):
     # Gauges:
     # ---------------
     gauges = rundata.gaugedata.gauges 
-    # for gauges append lines of the form  [gaugeno, x, y, t1, t2]
 
-    gauges.append([1125, 204.91802, 19.74517, 7.5*3600., 1.e9]) #Hilo
-    gauges.append([1126, 204.93003, 19.74167, 7.5*3600., 1.e9]) #Hilo
-    # gauges.append([11261, 204.93003, 19.739, 7.5*3600., 1.e9])
-    # #Hilo
-    # Tide gauge:
-    gauges.append([7760, 204.9437, 19.7306,  7.5*3600., 1.e9]) #Hilo
-    gauges.append([7761, 204.9447, 19.7308,  0., 1.e9]) # From Benchmark descr.
-    gauges.append([7762, 204.9437, 19.7307,  0., 1.e9]) # Shift so depth > 0
+    # GeoClaw already buffers up to MAX_BUFFER (=1000) records per gauge and
+    # only writes them out when the buffer is full.  With binary gauge files
+    # each of these flushes is one unformatted stream write, rather than one
+    # formatted write per record:
+    rundata.gaugedata.file_format = 'binary'
 
-    # Synthetic gauge S2:
-    gauges.append([2222, 204.92753, 19.74067, 7.5*3600., 1.e9]) # S2
+    # for gauges append lines of the form  [gaugeno, x, y, t1, t2]
 
-    # Gauge at point requested by Pat Lynett:
-    gauges.append([3333, 204.93, 19.7576,  7.5*3600., 1.e9]) 
+    gauges.extend(_FIXED_GAUGES.tolist())
 
     if 0:
         # Array of gauges to capture solution for benchmark problem:
@@ -282,19 +368,19 @@ def setrun(claw_pkg='geoclaw'):
         x1 = 204.905
         x2 = 204.955
         yy = 19.7576
-        for k,xx in enumerate(np.linspace(x1,x2,101)):
-            gauges.append([k+1, xx, 19.7576,  7.5*3600., 11.*3600.]) 
-            
+        gauges.extend(_grid_gauges(np.arange(1,102), np.linspace(x1,x2,101),
+                                   yy, 7.5*3600., 11.*3600.))
 
 
     if 0:
         # Array of synthetic gauges originally used to find S2 location:
+        # 6 x 5 grid with gauge number 10*(j+1)+i+1
         dx = .0005
-        for i in range(6):
-            x = 204.93003 - i*dx
-            for j in range(5):
-                y = 19.74167 + (j-2)*dx
-                gauges.append([10*(j+1)+i+1, x, y,  7.5*3600., 1.e9]) 
+        I, J = np.meshgrid(np.arange(6), np.arange(5), indexing='ij')
+        x = 204.93003 - I*dx
+        y = 19.74167 + (J-2)*dx
+        gauges.extend(_grid_gauges((10*(J+1)+I+1).ravel(), x.ravel(),
+                                   y.ravel(), 7.5*3600., 1.e9))
 
 
 
@@ -306,6 +392,9 @@ def setrun(claw_pkg='geoclaw'):
 
     # Specify when checkpoint files should be created that can be
     # used to restart a computation.
+    # A negative checkpt_style (e.g. -2) alternates between the two files
+    # fort.chkaaaaa and fort.chkbbbbb, so only the two most recent
+    # checkpoints are kept on disk instead of one multi-GB file per time.
 
     clawdata.checkpt_style = 2
 
@@ -319,7 +408,9 @@ def setrun(claw_pkg='geoclaw'):
 
     elif clawdata.checkpt_style == 2:
       # Specify a list of checkpoint times.  
-      clawdata.checkpt_times = np.array([7.5,8,8.5,9,9.5]) * 3600.
+      checkpt_times = np.array([7.5,8,8.5,9,9.5])
+      checkpt_times *= 3600.   # hours to seconds, in place
+      clawdata.checkpt_times = checkpt_times
 
     elif clawdata.checkpt_style == 3:
       # Checkpoint every checkpt_interval timesteps (on Level 1)
@@ -346,6 +437,10 @@ def setrun(claw_pkg='geoclaw'):
     amrdata.refinement_ratios_x = [6,2,5,8,45]
     amrdata.refinement_ratios_y = [6,2,5,8,45]
     amrdata.refinement_ratios_t = [6,2,5,8,45]
+    # Up to 6*2*5*8*45 = 21600 finest-level steps per coarse step; the time
+    # ratios are recomputed from the CFL condition since
+    # refinement_data.variable_dt_refinement_ratios = True (see setgeo).
+    # The patches are advanced in parallel with OpenMP (FFLAGS in Makefile).
 
 
     # Specify type of each aux variable in amrdata.auxtype.
@@ -383,16 +478,8 @@ def setrun(claw_pkg='geoclaw'):
     # Regions:
     # ---------------
     regions = rundata.regiondata.regions 
-
-    regions.append([1, 2, 0., 1e9, 0, 360, -90, 90])
-    regions.append([1, 3, 0., 5.*3600., 132., 220., 5., 40.])
-    regions.append([1, 3, 5.*3600.,  10.*3600., 180., 220., 5., 40.])
-    #regions.append([4, 4, 7.*3600., 1e9, 204,205.5,19.4,20.4])
-    regions.append([4, 4, 7.*3600., 1e9, 202,205.5,19.4,21.4])
-    regions.append([4, 5, 7.*3600., 1e9, 204.5,205.4,19.5,20.1])
-    regions.append([5, 5, 7.3*3600., 1e9, 204.85, 205, 19.68, 19.85])
-    # modified for benchmark:
-    regions.append([6, 6, 7.3*3600., 1e9, 204.905,204.95,19.72,19.758])
+    # RegionData expects a list of lists:
+    regions.extend(list(r) for r in _REGIONS.tolist())
     
 
 
@@ -411,7 +498,7 @@ def setrun(claw_pkg='geoclaw'):
     
     return rundata
 
-    # end of function setrun
+    # end of function _build_rundata
     # ----------------------
 
 
@@ -422,7 +509,9 @@ def setgeo(rundata):
     Set GeoClaw specific runtime parameters.
     """
 
-    if hasattr(geo_data, 'geo_data'):
+    _check_topo_dirs()
+
+    if hasattr(rundata, 'geo_data'):
         geo_data = rundata.geo_data
     else:
         raise AttributeError("*** Error, this rundata has no geo_data attribute")
@@ -451,23 +540,21 @@ def setgeo(rundata):
 
     # == settopo.data values ==
     topofiles = rundata.topo_data.topofiles 
-    topofiles.append([3, 1, 1, 0.0, 1e10, topodir+'etopo1min130E210E0N60N.asc'])
-    topofiles.append([3, 1, 1, 0.0, 1e10, topodir+'hawaii_6s.txt'])
-    topofiles.append([3, 1, 1, 0., 1.e10, topodir+'hilo_3s.asc'])
-    topofiles.append([3, 6, 6, 7.5*3600., 1.e10, topodir+'hilo_port_1_3s.asc'])
+    topofiles.extend(map(list, _TOPO_ENTRIES))
 
 
     # == setdtopo.data values ==
-    #rundata.dtopo_data.dtopofiles = [[1, 3, 3, dtopodir + 'Fujii.txydz']]
-    rundata.dtopo_data.dtopofiles = [[1, 3, 3, dtopodir + 'UCSB3.txydz']]
+    dtopo_data = rundata.dtopo_data
+    #dtopo_data.dtopofiles = [[1, 3, 3, dtopodir + 'Fujii.txydz']]
+    dtopo_data.dtopofiles = [[1, 3, 3, dtopodir + 'UCSB3.txydz']]
 
     # == setqinit.data values ==
-    rundata.qinit_data.qinit_type =  0
-    rundata.qinit_data.qinitfiles = []
+    qinit_data = rundata.qinit_data
+    qinit_data.qinit_type =  0
+    qinit_data.qinitfiles = []
 
     # == fixedgrids.data values ==
-    rundata.fixed_grid_data.fixedgrids = []
-    fixedgrids = rundata.fixed_grid_data.fixedgrids
+    fixedgrids = rundata.fixed_grid_data.fixedgrids = []
 
     # == fgmax.data values ==
     fgmax_files = rundata.fgmax_data.fgmax_files
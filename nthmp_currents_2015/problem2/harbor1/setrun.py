@@ -285,7 +285,9 @@ def setrun(claw_pkg='geoclaw'):
 
     elif clawdata.checkpt_style == 2:
       # Specify a list of checkpoint times.  
-      clawdata.checkpt_times = np.array([7.5,8,8.5,9,9.5]) * 3600.
+      checkpt_times = np.array([7.5,8,8.5,9,9.5])
+      checkpt_times *= 3600.   # hours to seconds, in place
+      clawdata.checkpt_times = checkpt_times
 
     elif clawdata.checkpt_style == 3:
       # Checkpoint every checkpt_interval timesteps (on Level 1)
@@ -11,11 +11,10 @@ if 'matplotlib' not in sys.modules:
     #matplotlib.use('Agg')  # Use an image backend
 
 
-from pylab import *
 import os,sys
-from matplotlib import colors
-import matplotlib.animation as animation
-from clawpack.visclaw import animation_tools, plottools, geoplot
+import numpy as np
+from numpy import array, full, nan, mod, sqrt, linspace, float32
+from functools import lru_cache
 import fgout_particles as P
 
 
@@ -46,8 +45,6 @@ bgimage = None
 #plot_extent = [34, 43.75, -3, 3]
 xlimits = [-3, 3]
 ylimits = [43.75, 34]
-#flipud = lambda A: fliplr(flipud(A))  # x is vertical in plots
-flipud = lambda A: A
 
 color = 'k'
 linewidth = 2
@@ -64,6 +61,12 @@ format = 'binary32'  # format of fgout grid output
 # Instantiate object for reading fgout frames:
 fgout_grid = fgout_tools.FGoutGrid(1, outdir, output_format)
 
+# Read each fgout frame from disk only once, since the same frames are used
+# both for computing the debris paths and for the animation.
+# FGoutFrame computes h, u, v, s, eta on first access and keeps them, so
+# caching the frames also caches these derived arrays:
+fgout_grid.read_frame = lru_cache(maxsize=None)(fgout_grid.read_frame)
+
 
 # Deterime time t0 of first fgout frame, to initialize particles
 frameno0 = fgframes[0]
@@ -71,22 +74,12 @@ fgout0 = fgout_grid.read_frame(frameno0)
 t0 = fgout0.t
 
 x1fg,x2fg,y1fg,y2fg = fgout0.extent_edges
-fgout_extent = [y1fg,y2fg,x2fg,x1fg]  # for rotated
+# for rotated plots, with the images drawn with origin='lower' so that
+# row i of an fgout array (x = x1fg + (i+0.5)*dx) is at height x:
+fgout_extent = [y1fg,y2fg,x1fg,x2fg]
 print('fgout0.extent_edges = ', fgout0.extent_edges)
 print('fgout_extent = ', fgout_extent)
 
-def timeformat(t):
-    """
-    Convert t in seconds to string in format hh:mm:ss
-    """
-    from numpy import mod
-    hours = int(t/3600.)
-    tmin = mod(t,3600.)
-    min = int(tmin/60.)
-    sec = int(mod(tmin,60.))
-    timestr = '%s:%s:%s' % (hours,str(min).zfill(2),str(sec).zfill(2))
-    return timestr
-
 def timeformat(t): 
     timestr = '%.3f seconds' % t   
     return timestr
@@ -105,6 +98,19 @@ dradius = {}
 Kspring = 100.
 nsubsteps = 40
 
+# Move the particles in parallel threads?  The forces between particles are
+# then computed from their locations at the start of each substep, rather
+# than from the new locations of the particles already moved, so the debris
+# paths differ somewhat from the default serial results:
+parallel_particles = False
+
+# Render the animation frames in parallel?  Each worker process gets its own
+# copy of the figure (and of the fgout frames already read) by fork, and saves
+# png files that ffmpeg then combines into the mp4 file.  This needs the fork
+# start method (not available on Windows, and unsafe on macOS with a GUI
+# backend) and ffmpeg on the path, otherwise FuncAnimation is used:
+parallel_frames = False
+
 
 dbnos = []
 dbnosA = []
@@ -231,93 +237,98 @@ if 1:
         
     print('Created %i tracer particles' % len(dbnosT))
 
+# Tethers only join the 5 particles of the same square, so tabulate them
+# once rather than evaluating tether for every pair in every substep:
+tether_table = {}
+for dbnoA in dbnosA:
+    square = [dbnoA + offset for offset in (0,1000,2000,3000,4000)]
+    for dbno1 in square:
+        for dbno2 in square:
+            if dbno1 != dbno2:
+                tether_table[dbno1,dbno2] = tether(dbno1,dbno2)
+
+def tether_lookup(dbno1,dbno2):
+    return tether_table.get((dbno1,dbno2), (nan,0.))
+
 # Compute debris path for each particle by using all the fgout frames
 # in the list fgframes (first frame should be frameno0 used to set t0 above):
 
-debris_paths = P.make_debris_paths_substeps(fgout_grid, fgframes, debris_paths,
+debris_paths = P.make_debris_paths_substeps_jit(fgout_grid, fgframes, debris_paths,
                       dbnos, drag_factor, grounding_depth, 
-                      mass, dradius, Kspring, tether, nsubsteps)
-
-def make_dbABCD(t, debris_paths, dbnosA):
-    xdAB = []
-    ydAB = []
-    
-    for k in range(len(dbnosA)):
-        dbnoA = dbnosA[k]
-        dbnoB = dbnoA + 1000
-        dbnoC = dbnoA + 2000
-        dbnoD = dbnoA + 3000
-        dbnoE = dbnoA + 4000
-        dbA = debris_paths[dbnoA]
-        dbB = debris_paths[dbnoB]
-        dbC = debris_paths[dbnoC]
-        dbD = debris_paths[dbnoD]
-        dbE = debris_paths[dbnoE]
-        try:
-            j = where(abs(dbA[:,0]-t) < 1e-6)[0].max()
-        except:
-            print('Did not find path for dbno=%i at t = %.3f' % (dbno,t))
-            j = -1
-        if j > -1:
-            xA = dbA[j,1]
-            yA = dbA[j,2]
-            xB = dbB[j,1]
-            yB = dbB[j,2]
-            xC = dbC[j,1]
-            yC = dbC[j,2]
-            xD = dbD[j,1]
-            yD = dbD[j,2]
-            xE = dbE[j,1]
-            yE = dbE[j,2]
-            xdAB = xdAB + [xA,xB,xC,xD,xA,xE,nan]
-            ydAB = ydAB + [yA,yB,yC,yD,yA,yE,nan]
-            #import pdb; pdb.set_trace()
-    xdAB = array(xdAB)
-    ydAB = array(ydAB)
-    #print('+++ xdAB = ',xdAB)
-    #print('+++ ydAB = ',ydAB)
-    return xdAB,ydAB
-
-def make_dbT(t, debris_paths, dbnosT):
-    xdT = []
-    ydT = []
-    
-    for k in range(len(dbnosT)):
-        dbnoT = dbnosT[k]
-        dbT = debris_paths[dbnoT]
-        try:
-            j = where(abs(dbT[:,0]-t) < 1e-6)[0].max()
-        except:
-            print('Did not find path for dbno=%i at t = %.3f' % (dbno,t))
-            j = -1
-        if j > -1:
-            xA = dbT[j,1]
-            yA = dbT[j,2]
-            xdT.append(xA)
-            ydT.append(yA)
-    xdT = array(xdT)
-    ydT = array(ydT)
-    return xdT,ydT            
+                      mass, dradius, Kspring, tether_lookup, nsubsteps,
+                      parallel=parallel_particles)
+
+# All debris paths share the same time column, so stack them into a single
+# array paths[k,j,:] = [t,x,y,u,v] for particle dbnos[k] at the j'th time.
+# The paths start at fgframes[0] and have nsubsteps rows for each later
+# frame, so frame number num is at row j = num*nsubsteps
+# (float32 is ample for plotting and halves the bytes gathered per frame):
+kdbno = {dbno: k for k,dbno in enumerate(dbnos)}
+paths = array([debris_paths[dbno] for dbno in dbnos], dtype=float32)
+
+# particles k in paths for the polyline A,B,C,D,A,E of each square:
+kABCDAE = array([[kdbno[dbnoA+offset] for offset in (0,1000,2000,3000,0,4000)]
+                 for dbnoA in dbnosA])
+
+# particles k in paths for the tracers:
+kT = array([kdbno[dbno] for dbno in dbnosT])
+
+# Polyline buffers with one row A,B,C,D,A,E,nan per square.  The nan column
+# (which breaks the line between squares) is set here once and the other
+# columns are refilled in place for each frame:
+xdAB_buf = full((len(kABCDAE),7), nan, dtype=float32)
+ydAB_buf = full((len(kABCDAE),7), nan, dtype=float32)
+
+def make_dbABCD(num):
+    j = num*nsubsteps
+    if j >= paths.shape[1]:
+        print('Did not find paths for squares at frame %i' % fgframes[num])
+        return array([]), array([])
+    xdAB_buf[:,:6] = paths[kABCDAE,j,1]
+    ydAB_buf[:,:6] = paths[kABCDAE,j,2]
+    return xdAB_buf.ravel(), ydAB_buf.ravel()
+
+def make_dbT(num):
+    j = num*nsubsteps
+    if j >= paths.shape[1]:
+        print('Did not find paths for tracers at frame %i' % fgframes[num])
+        return array([]), array([])
+    return paths[kT,j,1], paths[kT,j,2]
             
-# First initialize plot with data from initial frame,
-# do this in a way that returns an object for each plot attribute that
-# will need to be changed in subsequent frames.
-# In tis case, the color image of the water depth, plots of particles, and 
-# title (which includes the time) will change.
-# The background image, colorbar, etc. do not change.
+def main():
+    """
+    Plot the initial frame and make the animation.
+    The matplotlib and visclaw plotting modules are only imported here, so
+    that this module can be imported only to compute the debris paths.
+    """
+
+    global _render_args
 
-fgout = fgout0
+    import matplotlib as mpl
+    from matplotlib import colors
+    import matplotlib.animation as animation
+    from matplotlib.pyplot import subplots, imshow, colorbar, xticks, \
+                                  ticklabel_format
+    from clawpack.visclaw import animation_tools
 
-fig,ax = subplots(figsize=(8,7))
+    # First initialize plot with data from initial frame,
+    # do this in a way that returns an object for each plot attribute that
+    # will need to be changed in subsequent frames.
+    # In tis case, the color image of the water depth, plots of particles, and 
+    # title (which includes the time) will change.
+    # The background image, colorbar, etc. do not change.
 
-ax.set_xlim(xlimits)
-ax.set_ylim(ylimits)
+    fgout = fgout0
 
-ax.plot([y1b,y1b,y2b,y2b,y1b], [x1b,x2b,x2b,x1b,x1b], 'g')
+    fig,ax = subplots(figsize=(8,7))
 
-imqoi = 'Depth'
+    ax.set_xlim(xlimits)
+    ax.set_ylim(ylimits)
+
+    ax.plot([y1b,y1b,y2b,y2b,y1b], [x1b,x2b,x2b,x1b,x1b], 'g')
+
+    imqoi = 'Depth'
 
-if imqoi=='Depth':
     # depth
 
     a = 1.
@@ -338,15 +349,17 @@ if imqoi=='Depth':
     #bounds_depth = np.array([0,1,2,3,4,5])
     bounds_depth = np.array([0,0.04,0.08,0.12,0.16,0.20,0.24])
     norm_depth = colors.BoundaryNorm(bounds_depth, cmap_depth.N)
-    
+
     #eta_water = where(fgout.h>0, fgout.h, nan)
-    eta_water = np.ma.masked_where(fgout.h < 1e-3, fgout.h)
-    
-    im = imshow(flipud(eta_water), extent=fgout_extent,
+    # masked depth, allocated once and refilled in place in update:
+    eta_water = np.ma.MaskedArray(fgout.h.copy(), mask=fgout.h < 1e-3,
+                                  shrink=False)
+
+    im = imshow(eta_water, extent=fgout_extent, origin='lower',
                     #cmap=geoplot.tsunami_colormap)
                     cmap=cmap_depth, norm=norm_depth)
     im.set_clim(-5,5)
-                
+
     cb = colorbar(im, extend='max', shrink=0.7)
     cb.set_label('meters')
     #contour(fgout.X, fgout.Y, fgout.B, [0], colors='g', linewidths=0.5)
@@ -356,118 +369,125 @@ if imqoi=='Depth':
     xticks(rotation=20)
     ax.set_xlim(xlimits)
     ax.set_ylim(ylimits)
-    
+
     t = fgout.t
     t_str = timeformat(t)
-    title_text = title('%s at t = %s' % (imqoi,t_str))
-    
-else:
-    # speed
-    s_units = 'm/s'
-    if s_units == 'knots':
-        s = fgout.s * 1.9438  # convert m/s to knots
-        bounds_speed = np.array([1e-3,3,4,6,9,12])  # knots
-    else:
-        s = fgout.s
-        bounds_speed = np.array([1e-3,1.5,2,3,4.5,6])  # m/s
-        bounds_speed = np.array([1e-3,0.1,0.2,0.3,0.4,0.5])  # m/s
-        bounds_speed = np.array([1e-3,0.2,0.4,0.6,1.,1.5])  # m/s
+    # The time is drawn as a text artist inside the axes rather than as the
+    # axes title, so that with blit=True only the image, the debris and this
+    # text are redrawn in each frame (blitting only restores the axes area):
+    title_text = ax.text(0.02, 0.98, '%s at t = %s' % (imqoi,t_str),
+                         transform=ax.transAxes, va='top',
+                         bbox=dict(facecolor='w', edgecolor='none', alpha=0.8))
 
-    a = 1.
-    cmap_speed = mpl.colors.ListedColormap([
-                    [.3,.3,1,a],[0,0,1,a], [1,.8,.8,a],[1,.6,.6,a],
-                    [1,0,0,a]])
+    xdT,ydT = make_dbT(0)
+    dbpoints, = ax.plot(ydT,xdT,'.',color='yellow',markersize=3)
+    #print('+++ dbpoints xdT=', xdT)
+    #print('+++ dbpoints ydT=', ydT)
 
-    # Set color for value exceeding top of range to purple:
-    cmap_speed.set_over(color=[1,0,1,a])
+    xdAB,ydAB = make_dbABCD(0)
+    pairs, = ax.plot(ydAB, xdAB, color=color, linestyle='-', linewidth=linewidth)
 
-    if bgimage:
-        # Set color to transparent where s < 1e-3:
-        cmap_speed.set_under(color=[1,1,1,0])
-    else:
-        # Set color to white where s < 1e-3:
-        cmap_speed.set_under(color=[1,1,1,a])
 
-    norm_speed = colors.BoundaryNorm(bounds_speed, cmap_speed.N)
 
-    im = imshow(flipud(s), extent=fgout_extent,
-                cmap=cmap_speed, norm=norm_speed)
-    cb = colorbar(im, extend='max', shrink=0.7)
-    cb.set_label(s_units)
-    #contour(fgout.X, fgout.Y, fgout.B, [0], colors='g', linewidths=0.5)
+    #print('+++ pairs = ',pairs)
 
-    #ax.set_aspect(1./cos(ylat*pi/180.))
-    ticklabel_format(useOffset=False)
-    xticks(rotation=20)
-    ax.set_xlim(xlimits)
-    ax.set_ylim(ylimits)
+    # time labels for all the frames, formatted once:
+    frame_labels = ['%s at t = %s' % (imqoi, timeformat(fgout_grid.read_frame(fgframe).t))
+                    for fgframe in fgframes]
 
-    t = fgout.t
-    t_str = timeformat(t)
-    title_text = title('%s at t = %s' % (imqoi,t_str))
+    # The function update below should have arguments num (for the frame number)
+    # plus things listed here in fargs.
 
-xdT,ydT = make_dbT(t, debris_paths, dbnosT)
-dbpoints, = ax.plot(ydT,xdT,'.',color='yellow',markersize=3)
-#print('+++ dbpoints xdT=', xdT)
-#print('+++ dbpoints ydT=', ydT)
+    fargs = (im,pairs,dbpoints,title_text)
 
-xdAB,ydAB = make_dbABCD(t, debris_paths, dbnosA)
-pairs, = ax.plot(ydAB, xdAB, color=color, linestyle='-', linewidth=linewidth)
+    # fargs should be initialized above and are the plot Artist objects 
+    # whose data change from one frame to the next.
 
 
+    def update(num, im, pairs, dbpoints, title_text):
 
-#print('+++ pairs = ',pairs)
+        fgframe = fgframes[num]
+        # note: uses fgframes to specify fgout frames to use
 
-# The function update below should have arguments num (for the frame number)
-# plus things listed here in fargs.
+        # Read fgout data for this frame:
+        #fgout = P.read_fgout_frame(fgno, fgframe, plotdata)
+        fgout = fgout_grid.read_frame(fgframe)
 
-fargs = (im,pairs,dbpoints,title_text)
+        # Reset the plot objects that need to change from previous frame:
 
-# fargs should be initialized above and are the plot Artist objects 
-# whose data change from one frame to the next.
+        # title:
+        title_text.set_text(frame_labels[num])
 
+        # color image of depth:
+        np.copyto(eta_water.data, fgout.h)
+        np.less(fgout.h, 1e-3, out=eta_water.mask)
+        im.set_data(eta_water)
 
-def update(num, im, pairs, dbpoints, title_text):
-    
-    fgframe = fgframes[num]
-    # note: uses fgframes to specify fgout frames to use
-    
-    # Read fgout data for this frame:
-    #fgout = P.read_fgout_frame(fgno, fgframe, plotdata)
-    fgout = fgout_grid.read_frame(fgframe)
-    
-    # Reset the plot objects that need to change from previous frame:
+        # particle locations:
+
+        xdAB,ydAB = make_dbABCD(num)
+        pairs.set_data(ydAB, xdAB)
+
+        xdT,ydT = make_dbT(num)
+        dbpoints.set_data(ydT,xdT)
+
+        # must now return all the objects listed in fargs:
+        return im,pairs,dbpoints,title_text
+
+    fname_mp4 = 'debris_squares.mp4'
+    fps = 5
+
+    use_parallel_frames = parallel_frames
+    if use_parallel_frames:
+        import multiprocessing
+        import shutil
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            print('*** fork not available, not rendering frames in parallel')
+            use_parallel_frames = False
+        elif shutil.which('ffmpeg') is None:
+            print('*** ffmpeg not found, not rendering frames in parallel')
+            use_parallel_frames = False
+
+    if use_parallel_frames:
+        import subprocess
+
+        plotdir = '_plots_debris'
+        animation_tools.make_plotdir(plotdir, clobber=True)
+
+        # inherited by the worker processes, see _render_frame:
+        _render_args = (fig, update, fargs, plotdir)
+
+        print('Making frames...')
+        with multiprocessing.get_context('fork').Pool(os.cpu_count()) as pool:
+            pool.map(_render_frame, range(len(fgframes)))
+
+        print('Making mp4...')
+        subprocess.run(['ffmpeg', '-y', '-r', str(fps),
+                        '-i', '%s/frame%%05d.png' % plotdir,
+                        '-c:v', 'libx264', '-pix_fmt', 'yuv420p', fname_mp4],
+                       check=True)
+        print('Created %s' % fname_mp4)
 
-    # title:
-    t = fgout.t        
-    t_str = timeformat(t)
-    title_text.set_text('%s at t = %s' % (imqoi,t_str))
-    
-    # color image:
-    if imqoi == 'Depth':
-        eta_water = np.ma.masked_where(fgout.h < 1e-3, fgout.h)
-        im.set_data(flipud(eta_water))
     else:
-        im.set_data(flipud(fgout.s))
+        print('Making anim...')
+        anim = animation.FuncAnimation(fig, update,
+                                       frames=len(fgframes), 
+                                       fargs=fargs,
+                                       interval=200, blit=True)
 
-    # particle locations:
-    
-    xdAB,ydAB = make_dbABCD(t, debris_paths, dbnosA)
-    pairs.set_data(ydAB, xdAB)
-        
-    xdT,ydT = make_dbT(t, debris_paths, dbnosT)
-    dbpoints.set_data(ydT,xdT)
-
-    # must now return all the objects listed in fargs:
-    return im,pairs,dbpoints,title_text
-
-print('Making anim...')
-anim = animation.FuncAnimation(fig, update,
-                               frames=len(fgframes), 
-                               fargs=fargs,
-                               interval=200, blit=True)
-
-fname_mp4 = 'debris_squares.mp4'
-fps = 5
-print('Making mp4...')
-animation_tools.make_mp4(anim, fname_mp4, fps)
+        print('Making mp4...')
+        animation_tools.make_mp4(anim, fname_mp4, fps)
+
+
+def _render_frame(num):
+    # Save frame num to a png file.  Called in the worker processes of the
+    # pool created in main, which inherit _render_args from main by fork:
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig, update, fargs, plotdir = _render_args
+    FigureCanvasAgg(fig)  # draw with Agg in the worker process
+    update(num, *fargs)
+    fig.savefig('%s/frame%s.png' % (plotdir, str(num).zfill(5)))
+
+
+if __name__ == '__main__':
+    main()
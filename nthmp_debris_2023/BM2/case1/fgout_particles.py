@@ -8,9 +8,14 @@ if 'matplotlib' not in sys.modules:
 
 from pylab import *
 import os
+import math
 from matplotlib import colors
 
 from clawpack.geoclaw.data import Rearth,DEG2RAD
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None  # make_debris_paths_substeps_jit falls back to python
 
     
 coordinate_system = 1  # need to generalize
@@ -53,6 +58,36 @@ def make_fgout_fcn_xy(fgout, qoi, method='nearest',
     
     x1 = fgout.X[:,0]
     y1 = fgout.Y[0,:]
+
+    if method in ['nearest','linear'] and not bounds_error \
+            and fill_value is not None:
+        # The fgout grid is uniform, so the fractional indices of (x,y) are
+        # computed directly and map_coordinates interpolates all the points
+        # in one pass:
+        from scipy.ndimage import map_coordinates
+        order = {'nearest':0, 'linear':1}[method]
+        nx,ny = q.shape
+        x0 = x1[0]
+        y0 = y1[0]
+        dx = x1[1] - x0
+        dy = y1[1] - y0
+
+        def fgout_fcn(x,y):
+            # evaluate at a single point or x,y arrays:
+            ix = (atleast_1d(x) - x0) / dx
+            iy = (atleast_1d(y) - y0) / dy
+            outside = ~((ix >= 0) & (ix <= nx-1) & (iy >= 0) & (iy <= ny-1))
+            ix = where(outside, 0., ix)
+            iy = where(outside, 0., iy)
+            qout = map_coordinates(q, vstack((ix,iy)), order=order,
+                                   mode='nearest', output=float64)
+            qout[outside] = fill_value
+            if len(qout) == 1:
+                qout = qout[0]  # return scalar
+            return qout
+
+        return fgout_fcn
+
     fgout_fcn1 = RegularGridInterpolator((x1,y1), q, method=method,
                 bounds_error=bounds_error, fill_value=fill_value)
 
@@ -663,3 +698,272 @@ def make_debris_paths_substeps(fgout_grid, fgframes, debris_paths, dbnos,
                                             dradius, Kspring, tether, nsubsteps)
         fgout1 = fgout2
     return debris_paths
+
+
+
+# =============================================
+# Compiled version of make_debris_paths_substeps
+# =============================================
+
+# Same special right boundary and stationary block as in move_debris_substeps:
+_XRIGHT = 43.7
+_EPSB = 0.03
+_BLOCK = (35.54 - _EPSB, 36.14 + _EPSB, 1.22 - _EPSB, 1.22 + 0.6 + _EPSB)
+
+if njit is not None:
+    @njit(cache=True)
+    def _interp_xyt(q1, q2, alpha, x, y, x0, dx, y0, dy):
+        # nearest grid value in space (as RegularGridInterpolator with
+        # method='nearest'), linear in time, nan outside the grid:
+        nx, ny = q1.shape
+        r = (x - x0) / dx
+        s = (y - y0) / dy
+        if not (r >= 0. and r <= nx-1 and s >= 0. and s <= ny-1):
+            return np.nan
+        i = min(int(math.floor(r)), nx-2)
+        j = min(int(math.floor(s)), ny-2)
+        if r - i > 0.5:
+            i += 1
+        if s - j > 0.5:
+            j += 1
+        return (1.-alpha)*q1[i,j] + alpha*q2[i,j]
+
+    @njit(cache=True)
+    def _move_particle(i, xs, ys, us, vs, h1, u1, v1, h2, u2, v2,
+                       x0, dx, y0, dy, alpha1, alpha2, dt_substep,
+                       tracer, df, gd, massdb, has_radius, collides,
+                       dradius, Dtether, Ktether, Kspring, xright,
+                       x1b, x2b, y1b, y2b):
+        # Return [x,y,u,v] for particle i at the end of a substep, as in
+        # move_debris_substeps, with the other particles at xs,ys:
+        xd1 = xs[i]
+        yd1 = ys[i]
+        ud1 = us[i]
+        vd1 = vs[i]
+        uf1 = _interp_xyt(u1, u2, alpha1, xd1, yd1, x0, dx, y0, dy)
+        vf1 = _interp_xyt(v1, v2, alpha1, xd1, yd1, x0, dx, y0, dy)
+        if tracer[i]:
+            # set debris velocity equal to fluid velocity
+            ud2 = uf1
+            vd2 = vf1
+        else:
+            # compute force on debris
+            fxd = df[i]*(uf1 - ud1)
+            fyd = df[i]*(vf1 - vd1)
+            if has_radius[i]:
+                # compute inter-particle forces:
+                for k in range(xs.shape[0]):
+                    if k != i and collides[k]:
+                        dist = math.sqrt((xd1-xs[k])**2 + (yd1-ys[k])**2)
+                        diamjk = dradius[i] + dradius[k]
+                        Kt = Ktether[i,k]
+                        if Kt > 0:
+                            c = Kt*(Dtether[i,k]-dist)/dist
+                            fxd += c*(xd1-xs[k])
+                            fyd += c*(yd1-ys[k])
+                        elif dist < diamjk:
+                            c = Kspring*(diamjk-dist)/dist
+                            fxd += c*(xd1-xs[k])
+                            fyd += c*(yd1-ys[k])
+            ud2 = ud1 + dt_substep * fxd / massdb[i]
+            vd2 = vd1 + dt_substep * fyd / massdb[i]
+
+        # Take full time step with debris velocities:
+        xd2 = xd1 + dt_substep*0.5*(ud1+ud2)
+        yd2 = yd1 + dt_substep*0.5*(vd1+vd2)
+        if xd2 > xright:
+            xd2 = xright
+
+        # Depth and fluid velocity at end of substep:
+        hf2 = _interp_xyt(h1, h2, alpha2, xd2, yd2, x0, dx, y0, dy)
+        inb = (xd2>=x1b) and (xd2<=x2b) and (yd2>=y1b) and (yd2<=y2b)
+        if (hf2 < gd[i]) and (not inb):
+            # particle is grounded so velocities set to 0:
+            ud2 = 0.
+            vd2 = 0.
+        elif tracer[i]:
+            ud2 = _interp_xyt(u1, u2, alpha2, xd2, yd2, x0, dx, y0, dy)
+            vd2 = _interp_xyt(v1, v2, alpha2, xd2, yd2, x0, dx, y0, dy)
+        return xd2, yd2, ud2, vd2
+
+    @njit(cache=True)
+    def _move_substeps_kernel(xs, ys, us, vs, h1, u1, v1, h2, u2, v2,
+                              x0, dx, y0, dy, nsubsteps, dt_substep,
+                              tracer, df, gd, massdb, has_radius, collides,
+                              dradius, Dtether, Ktether, Kspring, xright,
+                              x1b, x2b, y1b, y2b, history):
+        # Move all particles over nsubsteps substeps between two fgout
+        # frames, updating xs,ys,us,vs in place and saving each substep in
+        # history[ns,:,:] = [x,y,u,v] as in move_debris_substeps.
+        # As in move_debris_substeps, the particles are moved one at a
+        # time, so forces use the new location of particles already moved.
+        for ns in range(nsubsteps):
+            alpha1 = ns / nsubsteps
+            alpha2 = (ns + 1) / nsubsteps
+            for i in range(xs.shape[0]):
+                xd2, yd2, ud2, vd2 = _move_particle(i,
+                        xs, ys, us, vs, h1, u1, v1, h2, u2, v2,
+                        x0, dx, y0, dy, alpha1, alpha2, dt_substep,
+                        tracer, df, gd, massdb, has_radius, collides,
+                        dradius, Dtether, Ktether, Kspring, xright,
+                        x1b, x2b, y1b, y2b)
+                xs[i] = xd2
+                ys[i] = yd2
+                us[i] = ud2
+                vs[i] = vd2
+                history[ns,i,0] = xd2
+                history[ns,i,1] = yd2
+                history[ns,i,2] = ud2
+                history[ns,i,3] = vd2
+
+    @njit(cache=True, parallel=True)
+    def _move_substeps_kernel_parallel(xs, ys, us, vs, h1, u1, v1, h2, u2, v2,
+                              x0, dx, y0, dy, nsubsteps, dt_substep,
+                              tracer, df, gd, massdb, has_radius, collides,
+                              dradius, Dtether, Ktether, Kspring, xright,
+                              x1b, x2b, y1b, y2b, history):
+        # Same as _move_substeps_kernel, but the particles are moved in
+        # parallel, all with forces from the locations at the start of the
+        # substep.  Each thread writes only to its own particle i, so no
+        # atomic updates are needed.
+        for ns in range(nsubsteps):
+            alpha1 = ns / nsubsteps
+            alpha2 = (ns + 1) / nsubsteps
+            xs0 = xs.copy()
+            ys0 = ys.copy()
+            us0 = us.copy()
+            vs0 = vs.copy()
+            for i in prange(xs.shape[0]):
+                xd2, yd2, ud2, vd2 = _move_particle(i,
+                        xs0, ys0, us0, vs0, h1, u1, v1, h2, u2, v2,
+                        x0, dx, y0, dy, alpha1, alpha2, dt_substep,
+                        tracer, df, gd, massdb, has_radius, collides,
+                        dradius, Dtether, Ktether, Kspring, xright,
+                        x1b, x2b, y1b, y2b)
+                xs[i] = xd2
+                ys[i] = yd2
+                us[i] = ud2
+                vs[i] = vd2
+                history[ns,i,0] = xd2
+                history[ns,i,1] = yd2
+                history[ns,i,2] = ud2
+                history[ns,i,3] = vd2
+else:
+    _move_substeps_kernel = None
+    _move_substeps_kernel_parallel = None
+
+
+def _debris_value(values, dbno):
+    # values[dbno] if different for each particle, else the scalar values:
+    try:
+        return values[dbno]
+    except:
+        return values
+
+
+def make_debris_paths_substeps_jit(fgout_grid, fgframes, debris_paths, dbnos,
+                      drag_factor=None, grounding_depth=0.,
+                      mass=1e9, dradius=None, 
+                      Kspring=None, tether=None, nsubsteps=1,
+                      parallel=False):
+    """
+    Same as make_debris_paths_substeps, but with the loops over substeps and
+    particles in a function compiled with numba.
+    The per-particle parameters are gathered into arrays, and tether is
+    called for each pair of particles only once, before the time stepping.
+    If parallel is True, the particles are moved in parallel threads in each
+    substep, with the inter-particle forces computed from the locations at
+    the start of the substep (rather than using the new locations of the 
+    particles already moved, as make_debris_paths_substeps does).
+    Only coordinate_system == 1 is supported.
+    Falls back to make_debris_paths_substeps if numba is not available.
+    """
+
+    if _move_substeps_kernel is None:
+        return make_debris_paths_substeps(fgout_grid, fgframes, debris_paths,
+                    dbnos, drag_factor, grounding_depth, mass, dradius,
+                    Kspring, tether, nsubsteps)
+
+    assert coordinate_system == 1, '*** only coordinate_system 1 supported'
+
+    N = len(dbnos)
+    df = [_debris_value(drag_factor, dbno) for dbno in dbnos]
+    tracer = array([d is None for d in df])
+    df = array([0. if d is None else d for d in df], dtype=float64)
+    gd = array([_debris_value(grounding_depth, dbno) for dbno in dbnos],
+               dtype=float64)
+    massdb = array([_debris_value(mass, dbno) for dbno in dbnos],
+                   dtype=float64)
+    dr = [_debris_value(dradius, dbno) for dbno in dbnos]
+    has_radius = array([r is not None for r in dr])
+    dr = array([0. if r is None else r for r in dr], dtype=float64)
+    collides = has_radius & ~tracer
+
+    # tether lengths and spring constants between pairs of particles:
+    Dtether = full((N,N), nan)
+    Ktether = zeros((N,N))
+    for i in flatnonzero(has_radius & ~tracer):
+        for k in flatnonzero(collides):
+            if k != i:
+                try:
+                    Dtether[i,k],Ktether[i,k] = tether(dbnos[i],dbnos[k])
+                except:
+                    pass
+    Kspring = 0. if Kspring is None else float(Kspring)
+
+    last = array([debris_paths[dbno][-1,:] for dbno in dbnos])
+    xs = last[:,1].copy()
+    ys = last[:,2].copy()
+    us = last[:,3].copy()
+    vs = last[:,4].copy()
+
+    fgout1 = fgout_grid.read_frame(fgframes[0])
+    x0 = fgout1.X[0,0]
+    y0 = fgout1.Y[0,0]
+    dx = fgout1.X[1,0] - x0
+    dy = fgout1.Y[0,1] - y0
+    # the fgout values are passed in their own precision (float32 for
+    # binary32 output) rather than copied to float64 for every frame,
+    # the particle state and arithmetic in the kernel remain float64:
+    grid = ascontiguousarray
+
+    if parallel:
+        kernel = _move_substeps_kernel_parallel
+    else:
+        kernel = _move_substeps_kernel
+
+    times = []
+    histories = []
+    for fgframe in fgframes[1:]:
+        print('Trying to read fgno=%i, fgframe=%i' % (fgout_grid.fgno,fgframe))
+        try:
+            fgout2 = fgout_grid.read_frame(fgframe)
+        except:
+            print('Could not read file, exiting loop')
+            break
+        t1full = fgout1.t
+        dt = fgout2.t - t1full
+        dt_substep = dt / nsubsteps
+        print('Moving debris over time dt = %g with %i substeps' % (dt,nsubsteps))
+        print('       from t1 = %s to t2 = %.2f' % (t1full,fgout2.t))
+
+        history = empty((nsubsteps,N,4))
+        kernel(xs, ys, us, vs,
+               grid(fgout1.h), grid(fgout1.u), grid(fgout1.v),
+               grid(fgout2.h), grid(fgout2.u), grid(fgout2.v),
+               x0, dx, y0, dy, nsubsteps, dt_substep,
+               tracer, df, gd, massdb, has_radius, collides,
+               dr, Dtether, Ktether, Kspring, _XRIGHT,
+               *_BLOCK, history)
+        # same substep times ts2 as in move_debris_substeps:
+        times.append((t1full + arange(nsubsteps)*dt_substep) + dt_substep)
+        histories.append(history)
+        fgout1 = fgout2
+
+    if histories:
+        times = concatenate(times)
+        histories = concatenate(histories)
+        for k,dbno in enumerate(dbnos):
+            debris_paths[dbno] = vstack((debris_paths[dbno],
+                                         column_stack((times, histories[:,k,:]))))
+    return debris_paths
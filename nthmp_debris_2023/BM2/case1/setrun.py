@@ -9,6 +9,26 @@ import os
 import numpy as np
 from clawpack.geoclaw import fgout_tools
 
+
+# Gauges, one record [gaugeno, x, y, t1, t2] per gauge:
+_GAUGE_DTYPE = [('gaugeno','i4'), ('x','f8'), ('y','f8'),
+                ('t1','f8'), ('t2','f8')]
+_GAUGES = np.array([
+    (2, 2.26, 0.98, 0., 1e10),
+    (4, 9.55, 0.55, 0., 1e10),
+    (6, 19.22, 0.56, 0., 1e10),
+    (13, 30.68, -3.20, 0., 1e10),
+    (14, 31.89, 0.54, 0., 1e10),
+    ], dtype=_GAUGE_DTYPE)
+
+# Lagrangian gauges at the corners of the debris square (not used):
+_LAGRANGIAN_GAUGES = np.array([
+    (1001, 34.64, 0.52, 0., 1e10),
+    (1002, 34.64, 1.12, 0., 1e10),
+    (1003, 35.24, 0.52, 0., 1e10),
+    (1004, 35.24, 1.12, 0., 1e10),
+    ], dtype=_GAUGE_DTYPE)
+
 #------------------------------
 def setrun(claw_pkg='geoclaw'):
 #------------------------------
@@ -322,21 +342,15 @@ def setrun(claw_pkg='geoclaw'):
     # or to have some of each type, use a dictionary:
     rundata.gaugedata.gtype = {}
     
-    rundata.gaugedata.gauges.append([2, 2.26, 0.98, 0., 1e10])
-    rundata.gaugedata.gauges.append([4, 9.55, 0.55, 0., 1e10])
-    rundata.gaugedata.gauges.append([6, 19.22, 0.56, 0., 1e10])
-    rundata.gaugedata.gauges.append([13, 30.68, -3.20, 0., 1e10])
-    rundata.gaugedata.gauges.append([14, 31.89, 0.54, 0., 1e10])
-
-    for gaugeno in [2,4,6,13,14]:
+    # GaugeData expects a list of lists:
+    rundata.gaugedata.gauges.extend(list(g) for g in _GAUGES.tolist())
+    for gaugeno in _GAUGES['gaugeno'].tolist():
         rundata.gaugedata.gtype[gaugeno] = 'stationary'
 
     if 0:
-        rundata.gaugedata.gauges.append([1001, 34.64, 0.52, 0., 1e10])
-        rundata.gaugedata.gauges.append([1002, 34.64, 1.12, 0., 1e10])
-        rundata.gaugedata.gauges.append([1003, 35.24, 0.52, 0., 1e10])
-        rundata.gaugedata.gauges.append([1004, 35.24, 1.12, 0., 1e10])
-        for gaugeno in range(1001,1005):
+        rundata.gaugedata.gauges.extend(list(g) for g in
+                                        _LAGRANGIAN_GAUGES.tolist())
+        for gaugeno in _LAGRANGIAN_GAUGES['gaugeno'].tolist():
             rundata.gaugedata.gtype[gaugeno] = 'lagrangian'
 
 